@@ -0,0 +1,116 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Compiled MIDI-to-relay hot path for the /dev/gpiomem backend.
+Build in place with: cythonize -i _piano_hot.pyx
+"""
+
+from posix.time cimport clock_gettime, timespec, CLOCK_MONOTONIC
+
+cdef extern from *:
+    """
+    static inline void gpio_reg_write(unsigned char *base, size_t offset, unsigned int value) {
+        *(volatile unsigned int *)(base + offset) = value;
+    }
+    """
+    void gpio_reg_write(unsigned char *base, size_t offset, unsigned int value) nogil
+
+cdef enum:
+    GPSET0 = 0x1C
+    GPCLR0 = 0x28
+    UNMAPPED = 0xFF
+    MAX_RELAYS = 32
+
+
+cdef inline double monotonic() nogil:
+    """Same clock as time.monotonic() on Linux."""
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+
+
+cdef class Hot:
+    """Note LUT, per-relay reference counts and GPIO register writes in one C call."""
+    cdef unsigned char lut[128]
+    cdef unsigned int masks[MAX_RELAYS]
+    cdef unsigned char[::1] held
+    cdef int[::1] refcount
+    cdef double[::1] off_deadline
+    cdef object deferred
+    cdef double debounce
+    cdef unsigned char[::1] regs
+    cdef unsigned char *base
+
+    def __cinit__(self, const unsigned char[::1] note_to_relay, unsigned char[::1] held,
+                  int[::1] refcount, masks,
+                  unsigned char[::1] regs, double[::1] off_deadline, deferred, double debounce):
+        cdef int i
+        if note_to_relay.shape[0] != 128 or held.shape[0] != 128:
+            raise ValueError("note_to_relay and held must have 128 entries")
+        if (len(masks) > MAX_RELAYS or refcount.shape[0] < len(masks)
+                or off_deadline.shape[0] < len(masks)):
+            raise ValueError("too many relays")
+        for i in range(128):
+            self.lut[i] = note_to_relay[i]
+        for i, mask in enumerate(masks):
+            self.masks[i] = mask
+        # Shares the controller's held-note, refcount and deferred-OFF arrays so both paths agree
+        self.held = held
+        self.refcount = refcount
+        self.off_deadline = off_deadline
+        self.deferred = deferred
+        self.debounce = debounce
+        self.regs = regs
+        self.base = &regs[0]
+
+    cpdef on_event(self, int status, int note, int velocity):
+        """Handle one channel voice message."""
+        cdef int kind = status & 0xF0
+        cdef int relay_channel, count
+
+        if self.base == NULL or note < 0 or note > 127:
+            return
+        relay_channel = self.lut[note]
+        if relay_channel == UNMAPPED:
+            return
+
+        if kind == 0x90 and velocity:
+            # A repeated Note On for a sounding note must not count the key twice
+            if self.held[note]:
+                return
+            self.held[note] = 1
+            count = self.refcount[relay_channel]
+            self.refcount[relay_channel] = count + 1
+            if count == 0:
+                # Absorb a deferred OFF that has not fired yet (see relay_on)
+                if self.off_deadline[relay_channel]:
+                    with self.deferred:
+                        if self.off_deadline[relay_channel]:
+                            self.off_deadline[relay_channel] = 0.0
+                            return
+                    # The GIL was released while waiting for the lock; release() may have run
+                    if self.base == NULL:
+                        return
+                # Active-low relay board: clearing the pin turns the relay on
+                gpio_reg_write(self.base, GPCLR0, self.masks[relay_channel])
+        elif kind == 0x80 or kind == 0x90:
+            if not self.held[note]:
+                return
+            self.held[note] = 0
+            count = self.refcount[relay_channel]
+            self.refcount[relay_channel] = count - 1
+            if count == 1:
+                # The controller's main thread writes the OFF once the window passes
+                with self.deferred:
+                    self.off_deadline[relay_channel] = monotonic() + self.debounce
+                    self.deferred.notify()
+
+    def on_message(self, event, data=None):
+        """rtmidi callback: unpack the message and dispatch to on_event."""
+        message = event[0]
+        if len(message) == 3:
+            self.on_event(message[0], message[1], message[2])
+
+    def release(self):
+        """Stop writing and drop the register mapping so it can be closed."""
+        self.base = NULL
+        self.regs = None
@@ -0,0 +1,238 @@
+"""
+Minimal ALSA sequencer MIDI input via ctypes.
+Reads note events straight from libasound on an in-process thread, without the RTMidi layer.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import threading
+import traceback
+from typing import Callable, List, Optional, Tuple
+
+SND_SEQ_OPEN_INPUT = 2
+SND_SEQ_NONBLOCK = 1
+
+SND_SEQ_PORT_CAP_READ = 1 << 0
+SND_SEQ_PORT_CAP_WRITE = 1 << 1
+SND_SEQ_PORT_CAP_SUBS_READ = 1 << 5
+SND_SEQ_PORT_CAP_SUBS_WRITE = 1 << 6
+SND_SEQ_PORT_CAP_NO_EXPORT = 1 << 7
+SND_SEQ_PORT_TYPE_MIDI_GENERIC = 1 << 1
+SND_SEQ_PORT_TYPE_APPLICATION = 1 << 20
+
+SND_SEQ_EVENT_NOTEON = 6
+SND_SEQ_EVENT_NOTEOFF = 7
+
+SYSTEM_CLIENT = 0
+
+
+class SeqEvent(ctypes.Structure):
+    """snd_seq_event_t, with the data union laid out as snd_seq_ev_note_t."""
+    _fields_ = [
+        ('type', ctypes.c_ubyte),
+        ('flags', ctypes.c_ubyte),
+        ('tag', ctypes.c_ubyte),
+        ('queue', ctypes.c_ubyte),
+        ('time', ctypes.c_uint * 2),
+        ('source', ctypes.c_ubyte * 2),
+        ('dest', ctypes.c_ubyte * 2),
+        ('channel', ctypes.c_ubyte),
+        ('note', ctypes.c_ubyte),
+        ('velocity', ctypes.c_ubyte),
+        ('off_velocity', ctypes.c_ubyte),
+        ('duration', ctypes.c_uint),
+        ('reserved', ctypes.c_uint),  # Rest of the 12-byte data union
+    ]
+
+
+class PollFd(ctypes.Structure):
+    _fields_ = [('fd', ctypes.c_int), ('events', ctypes.c_short), ('revents', ctypes.c_short)]
+
+
+def load_libasound() -> ctypes.CDLL:
+    """Load libasound and declare the sequencer functions we call."""
+    lib = ctypes.CDLL(ctypes.util.find_library('asound') or 'libasound.so.2')
+
+    p = ctypes.c_void_p
+    pp = ctypes.POINTER(ctypes.c_void_p)
+    signatures = {
+        'snd_seq_open': (ctypes.c_int, [pp, ctypes.c_char_p, ctypes.c_int, ctypes.c_int]),
+        'snd_seq_close': (ctypes.c_int, [p]),
+        'snd_seq_set_client_name': (ctypes.c_int, [p, ctypes.c_char_p]),
+        'snd_seq_client_id': (ctypes.c_int, [p]),
+        'snd_seq_create_simple_port': (ctypes.c_int, [p, ctypes.c_char_p, ctypes.c_uint, ctypes.c_uint]),
+        'snd_seq_connect_from': (ctypes.c_int, [p, ctypes.c_int, ctypes.c_int, ctypes.c_int]),
+        'snd_seq_disconnect_from': (ctypes.c_int, [p, ctypes.c_int, ctypes.c_int, ctypes.c_int]),
+        'snd_seq_event_input': (ctypes.c_int, [p, ctypes.POINTER(ctypes.POINTER(SeqEvent))]),
+        'snd_seq_poll_descriptors_count': (ctypes.c_int, [p, ctypes.c_short]),
+        'snd_seq_poll_descriptors': (ctypes.c_int, [p, ctypes.POINTER(PollFd), ctypes.c_uint, ctypes.c_short]),
+        'snd_seq_query_next_client': (ctypes.c_int, [p, p]),
+        'snd_seq_query_next_port': (ctypes.c_int, [p, p]),
+        'snd_seq_client_info_malloc': (ctypes.c_int, [pp]),
+        'snd_seq_client_info_free': (None, [p]),
+        'snd_seq_client_info_set_client': (None, [p, ctypes.c_int]),
+        'snd_seq_client_info_get_client': (ctypes.c_int, [p]),
+        'snd_seq_client_info_get_name': (ctypes.c_char_p, [p]),
+        'snd_seq_port_info_malloc': (ctypes.c_int, [pp]),
+        'snd_seq_port_info_free': (None, [p]),
+        'snd_seq_port_info_set_client': (None, [p, ctypes.c_int]),
+        'snd_seq_port_info_set_port': (None, [p, ctypes.c_int]),
+        'snd_seq_port_info_get_port': (ctypes.c_int, [p]),
+        'snd_seq_port_info_get_name': (ctypes.c_char_p, [p]),
+        'snd_seq_port_info_get_capability': (ctypes.c_uint, [p]),
+        'snd_strerror': (ctypes.c_char_p, [ctypes.c_int]),
+    }
+    for name, (restype, argtypes) in signatures.items():
+        func = getattr(lib, name)
+        func.restype = restype
+        func.argtypes = argtypes
+    return lib
+
+
+def sequencer_available() -> bool:
+    """Return True if libasound loads and a sequencer client can be opened."""
+    try:
+        AlsaSeqInput().close_port()
+    except (OSError, AttributeError):  # AttributeError: libasound lacks a symbol we need
+        return False
+    return True
+
+
+class AlsaSeqInput:
+    """ALSA sequencer input port with an RTMidi-like port API.
+
+    The callback is called as callback(status, note, velocity) for Note On/Off events,
+    from a thread that sleeps in poll() between events.
+    """
+
+    def __init__(self, client_name: str = "Piano Lights"):
+        self._lib = load_libasound()
+        self._seq = ctypes.c_void_p()
+        self.check_result(self._lib.snd_seq_open(ctypes.byref(self._seq), b"default",
+                                           SND_SEQ_OPEN_INPUT, SND_SEQ_NONBLOCK))
+        try:
+            self._lib.snd_seq_set_client_name(self._seq, client_name.encode())
+            self._port = self.check_result(self._lib.snd_seq_create_simple_port(
+                self._seq, b"Input",
+                SND_SEQ_PORT_CAP_WRITE | SND_SEQ_PORT_CAP_SUBS_WRITE,
+                SND_SEQ_PORT_TYPE_MIDI_GENERIC | SND_SEQ_PORT_TYPE_APPLICATION))
+        except OSError:
+            self._lib.snd_seq_close(self._seq)
+            raise
+
+        self._sources: List[Tuple[int, int]] = []
+        self._connected: Optional[Tuple[int, int]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._wake_r, self._wake_w = os.pipe()
+
+    def check_result(self, result: int) -> int:
+        if result < 0:
+            raise OSError(-result, self._lib.snd_strerror(result).decode())
+        return result
+
+    def get_ports(self) -> List[str]:
+        """List readable ports as 'client:port name client_id:port_id', like RTMidi does."""
+        lib = self._lib
+        own_client = lib.snd_seq_client_id(self._seq)
+        client_info = ctypes.c_void_p()
+        port_info = ctypes.c_void_p()
+        self.check_result(lib.snd_seq_client_info_malloc(ctypes.byref(client_info)))
+        self.check_result(lib.snd_seq_port_info_malloc(ctypes.byref(port_info)))
+
+        names = []
+        self._sources = []
+        wanted = SND_SEQ_PORT_CAP_READ | SND_SEQ_PORT_CAP_SUBS_READ
+        try:
+            lib.snd_seq_client_info_set_client(client_info, -1)
+            while lib.snd_seq_query_next_client(self._seq, client_info) >= 0:
+                client = lib.snd_seq_client_info_get_client(client_info)
+                if client in (SYSTEM_CLIENT, own_client):
+                    continue
+                client_name = lib.snd_seq_client_info_get_name(client_info).decode(errors='replace')
+
+                lib.snd_seq_port_info_set_client(port_info, client)
+                lib.snd_seq_port_info_set_port(port_info, -1)
+                while lib.snd_seq_query_next_port(self._seq, port_info) >= 0:
+                    caps = lib.snd_seq_port_info_get_capability(port_info)
+                    if caps & wanted != wanted or caps & SND_SEQ_PORT_CAP_NO_EXPORT:
+                        continue
+                    port = lib.snd_seq_port_info_get_port(port_info)
+                    port_name = lib.snd_seq_port_info_get_name(port_info).decode(errors='replace')
+                    names.append(f"{client_name}:{port_name} {client}:{port}")
+                    self._sources.append((client, port))
+        finally:
+            lib.snd_seq_port_info_free(port_info)
+            lib.snd_seq_client_info_free(client_info)
+
+        return names
+
+    def open_port(self, index: int):
+        """Subscribe our input port to the source returned at `index` by get_ports()."""
+        client, port = self._sources[index]
+        self.check_result(self._lib.snd_seq_connect_from(self._seq, self._port, client, port))
+        self._connected = (client, port)
+
+    def set_callback(self, callback: Callable[[int, int, int], None]):
+        """Start delivering note events to `callback` on the reader thread."""
+        self._thread = threading.Thread(target=self.read_events, args=(callback,), daemon=True)
+        self._thread.start()
+
+    def read_events(self, callback: Callable[[int, int, int], None]):
+        lib = self._lib
+        seq = self._seq
+        count = lib.snd_seq_poll_descriptors_count(seq, select.POLLIN)
+        pfds = (PollFd * count)()
+        lib.snd_seq_poll_descriptors(seq, pfds, count, select.POLLIN)
+
+        poller = select.poll()
+        poller.register(self._wake_r, select.POLLIN)
+        for pfd in pfds:
+            poller.register(pfd.fd, select.POLLIN)
+
+        event_input = lib.snd_seq_event_input
+        ev = ctypes.POINTER(SeqEvent)()
+        ev_ref = ctypes.byref(ev)
+        wake_fd = self._wake_r
+        overrun = -errno.ENOSPC
+        while True:
+            ready = poller.poll()
+            if any(fd == wake_fd for fd, _ in ready):
+                return
+
+            while True:
+                result = event_input(seq, ev_ref)
+                if result < 0:
+                    if result == overrun:  # Input queue overflowed; keep reading what is left
+                        continue
+                    break  # -EAGAIN: queue drained
+                event = ev.contents
+                try:
+                    if event.type == SND_SEQ_EVENT_NOTEON:
+                        callback(0x90 | event.channel, event.note, event.velocity)
+                    elif event.type == SND_SEQ_EVENT_NOTEOFF:
+                        callback(0x80 | event.channel, event.note, event.velocity)
+                except Exception:
+                    # Report and keep reading, as RTMidi does, rather than killing input
+                    traceback.print_exc()
+
+    def close_port(self):
+        """Stop the reader thread and close the sequencer."""
+        if self._thread is not None:
+            os.write(self._wake_w, b'\0')
+            self._thread.join()
+            self._thread = None
+
+        if self._seq:
+            if self._connected is not None:
+                self._lib.snd_seq_disconnect_from(self._seq, self._port, *self._connected)
+                self._connected = None
+            self._lib.snd_seq_close(self._seq)
+            self._seq = ctypes.c_void_p()
+
+        if self._wake_w >= 0:
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            self._wake_r = self._wake_w = -1
@@ -0,0 +1,487 @@
+"""
+Christmas Piano Lights Controller core
+Relay GPIO control and note handling shared by every MIDI input backend.
+"""
+
+import gc
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import deque
+from typing import Optional, Tuple
+import RPi.GPIO as GPIO
+
+try:
+    from _piano_hot import Hot  # Optional compiled hot path (cythonize -i _piano_hot.pyx)
+except ImportError:
+    Hot = None
+
+# Sentinel in the note-to-relay lookup table for notes without a relay
+UNMAPPED = 0xFF
+
+# MIDI status byte -> message kind, so the callback classifies with one index
+NOTE_OFF = 1
+NOTE_ON = 2
+STATUS_KIND = bytes([NOTE_OFF if 0x80 <= status <= 0x8F else
+                     NOTE_ON if 0x90 <= status <= 0x9F else 0
+                     for status in range(256)])
+
+# BCM283x GPIO register block (Pi Zero through Pi 4), as exposed by /dev/gpiomem
+GPIO_MEM_PATH = '/dev/gpiomem'
+GPIO_BLOCK_SIZE = 4096
+GPSET0 = 0x1C  # Write 1 bits to drive pins 0-31 HIGH
+GPCLR0 = 0x28  # Write 1 bits to drive pins 0-31 LOW
+FSEL_INPUT = 0b000
+FSEL_OUTPUT = 0b001
+GPIO_REG = struct.Struct('<I')
+
+# Legacy sysfs GPIO interface, used when /dev/gpiomem cannot be mapped
+SYSFS_GPIO_PATH = '/sys/class/gpio'
+SYSFS_EXPORT_TIMEOUT_S = 1.0  # How long udev may take to grant access to a new export
+
+# CPU reserved for MIDI handling (boot with isolcpus=3) and its SCHED_FIFO priority
+RT_CPU = 3
+RT_PRIORITY = 80
+
+# Relay OFFs are held back this long so a quick re-press in the same range needs no writes
+DEBOUNCE_S = 0.005
+
+class PianoLightsController:
+    """Base controller; subclasses supply setup_midi() and the MIDI callback it installs."""
+
+    def __init__(self, verbose: bool = False):
+        # GPIO pins for 7-channel relay board (only using first 7)
+        self.relay_pins = array('B', [18, 19, 20, 21, 22, 23, 24])
+
+        # Setup note-to-relay mapping
+        self.setup_note_mapping()
+
+        # Which notes are held (1) and how many held keys fall within each relay's range
+        self._note_held = bytearray(128)
+        self._relay_refcount = array('i', [0] * len(self.relay_pins))
+
+        # Monotonic time at which each relay's deferred OFF is due (0.0 = none pending)
+        self._off_deadline = array('d', [0.0] * len(self.relay_pins))
+        self._deferred = threading.Condition()
+
+        # Per-note log lines are queued here and written out by a background thread
+        self._verbose = verbose
+        self._log_q = deque(maxlen=1024)
+
+        # MIDI setup
+        self.midi_input = None
+        self._hot = None
+        self.running = False
+
+        self._gpio_mem = None
+        self._val_fds = None
+        self._sysfs_exported = []
+
+        try:
+            self.setup_gpio()
+            # Before setup_midi so the MIDI callback thread inherits the policy and affinity
+            self.setup_realtime()
+            self.setup_hot_path()
+            self.setup_midi()
+        except BaseException:
+            # Don't leave relay pins driven, mapped or exported when startup fails
+            if self.midi_input:
+                self.midi_input.close_port()
+                self.midi_input = None
+            self.release_gpio()
+            raise
+
+    def setup_note_mapping(self):
+        """Setup mapping from MIDI notes to relay channels."""
+        # Flat lookup table indexed by MIDI note number (0-127)
+        note_to_relay = bytearray([UNMAPPED]) * 128
+
+        # 7-relay mapping focusing on most-used keys (43-70)
+        # Relays 0 and 6 handle leftover low/high keys plus their main range
+        octave_ranges = (
+            (21, 46, 0),   # A0-A#2 (bass leftovers + main) -> Relay 0 (26 keys)
+            (47, 50, 1),   # B2-D3 -> Relay 1 (4 keys)
+            (51, 54, 2),   # D#3-F#3 -> Relay 2 (4 keys)
+            (55, 58, 3),   # G3-A#3 -> Relay 3 (4 keys)
+            (59, 62, 4),   # B3-D4 (Middle C region) -> Relay 4 (4 keys)
+            (63, 66, 5),   # D#4-F#4 -> Relay 5 (4 keys)
+            (67, 108, 6),  # G4-C8 (main + treble leftovers) -> Relay 6 (42 keys)
+        )
+
+        for start_note, end_note, relay_channel in octave_ranges:
+            note_to_relay[start_note:end_note + 1] = bytes([relay_channel]) * (end_note - start_note + 1)
+
+        # Read-only from here on
+        self.note_to_relay = bytes(note_to_relay)
+
+        mapped_keys = 128 - self.note_to_relay.count(UNMAPPED)
+        print(f"Octave mapping loaded: {mapped_keys} keys mapped to 7 relays")
+
+    def setup_gpio(self):
+        """Initialize GPIO pins for relay control."""
+        self._gpio_mem = self.open_gpio_mem()
+        self._val_fds = None
+
+        if self._gpio_mem is not None:
+            regs = self._gpio_mem
+
+            # One SET write covering every relay pin turns the whole board off at once
+            self._all_off_args = ((regs, GPSET0, sum(1 << pin for pin in self.relay_pins)),)
+
+            # Drive pins HIGH before switching them to outputs so no relay clicks on
+            GPIO_REG.pack_into(*self._all_off_args[0])
+            for pin in self.relay_pins:
+                self.set_pin_function(pin, FSEL_OUTPUT)
+
+            # Precomputed (regs, register, bitmask) per relay channel for the MIDI callback path
+            self._relay_write = GPIO_REG.pack_into
+            self._relay_masks = tuple(1 << pin for pin in self.relay_pins)
+            self._on_args = tuple((regs, GPCLR0, mask) for mask in self._relay_masks)
+            self._off_args = tuple((regs, GPSET0, mask) for mask in self._relay_masks)
+
+            print(f"GPIO initialized via {GPIO_MEM_PATH} for pins: {list(self.relay_pins)}")
+            return
+
+        self._val_fds = self.open_sysfs_values()
+
+        if self._val_fds is not None:
+            # Precomputed (fd, value) per relay channel; value files stay open for every write
+            self._relay_write = os.write
+            self._on_args = tuple((fd, b'0') for fd in self._val_fds)
+            self._off_args = tuple((fd, b'1') for fd in self._val_fds)
+            self._all_off_args = self._off_args
+
+            print(f"GPIO initialized via {SYSFS_GPIO_PATH} for pins: {list(self.relay_pins)}")
+            return
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+
+        # Setup relay pins as outputs, initially HIGH (relays off for active-low boards)
+        setup, out, output_mode, high = GPIO.setup, GPIO.output, GPIO.OUT, GPIO.HIGH
+        for pin in self.relay_pins:
+            setup(pin, output_mode)
+            out(pin, high)  # Most relay boards are active-low
+
+        # Precomputed (pin, level) pairs per relay channel for the MIDI callback path
+        self._relay_write = GPIO.output
+        self._on_args = tuple((pin, GPIO.LOW) for pin in self.relay_pins)
+        self._off_args = tuple((pin, GPIO.HIGH) for pin in self.relay_pins)
+        self._all_off_args = self._off_args
+
+        print(f"GPIO initialized for pins: {list(self.relay_pins)}")
+
+    def open_gpio_mem(self) -> Optional[mmap.mmap]:
+        """Map the GPIO register block, or return None to fall back to RPi.GPIO."""
+        try:
+            fd = os.open(GPIO_MEM_PATH, os.O_RDWR | os.O_SYNC)
+        except OSError:
+            return None
+
+        try:
+            return mmap.mmap(fd, GPIO_BLOCK_SIZE, mmap.MAP_SHARED,
+                             mmap.PROT_READ | mmap.PROT_WRITE)
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+
+    def open_sysfs_values(self) -> Optional[Tuple[int, ...]]:
+        """Export the relay pins through sysfs and open their value files once."""
+        base = self.sysfs_gpio_base()
+        fds = []
+        exported = []
+        try:
+            for pin in self.relay_pins:
+                gpio_dir = f"{SYSFS_GPIO_PATH}/gpio{base + pin}"
+                # "high" makes the pin an output already driving HIGH, so no relay clicks on
+                if os.path.isdir(gpio_dir):
+                    self.write_sysfs(f"{gpio_dir}/direction", "high")
+                else:
+                    self.write_sysfs(f"{SYSFS_GPIO_PATH}/export", base + pin)
+                    exported.append(base + pin)
+                    self.write_sysfs_when_ready(f"{gpio_dir}/direction", "high")
+                fds.append(os.open(f"{gpio_dir}/value", os.O_WRONLY))
+        except OSError:
+            for fd in fds:
+                os.close(fd)
+            for gpio in exported:
+                try:
+                    self.write_sysfs(f"{SYSFS_GPIO_PATH}/unexport", gpio)
+                except OSError:
+                    pass
+            return None
+
+        # Only pins we exported ourselves are handed back at shutdown
+        self._sysfs_exported = exported
+        return tuple(fds)
+
+    def close_sysfs_values(self):
+        """Close the sysfs value files and release the pins we exported as inputs."""
+        for fd in self._val_fds:
+            os.close(fd)
+        self._val_fds = None
+
+        # Pins that were already exported at startup are left as we found them
+        for gpio in self._sysfs_exported:
+            try:
+                self.write_sysfs(f"{SYSFS_GPIO_PATH}/gpio{gpio}/direction", "in")
+                self.write_sysfs(f"{SYSFS_GPIO_PATH}/unexport", gpio)
+            except OSError:
+                pass
+        self._sysfs_exported = []
+
+    def sysfs_gpio_base(self) -> int:
+        """Return the sysfs number of BCM GPIO 0 (non-zero on newer kernels)."""
+        try:
+            chips = [name for name in os.listdir(SYSFS_GPIO_PATH) if name.startswith('gpiochip')]
+        except OSError:
+            return 0
+
+        for chip in chips:
+            try:
+                with open(f"{SYSFS_GPIO_PATH}/{chip}/label") as f:
+                    label = f.read().strip()
+                if label.startswith('pinctrl-bcm'):
+                    with open(f"{SYSFS_GPIO_PATH}/{chip}/base") as f:
+                        return int(f.read())
+            except (OSError, ValueError):
+                continue
+        return 0
+
+    def write_sysfs(self, path: str, value):
+        """Write a single value to a sysfs attribute file."""
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            os.write(fd, str(value).encode())
+        finally:
+            os.close(fd)
+
+    def write_sysfs_when_ready(self, path: str, value):
+        """Write a sysfs attribute of a fresh export, retrying until udev grants access."""
+        deadline = time.monotonic() + SYSFS_EXPORT_TIMEOUT_S
+        while True:
+            try:
+                self.write_sysfs(path, value)
+                return
+            except PermissionError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.01)
+
+    def set_pin_function(self, pin: int, function: int):
+        """Program a pin's function select bits in the mapped GPFSEL register."""
+        offset = (pin // 10) * 4
+        shift = (pin % 10) * 3
+        value = GPIO_REG.unpack_from(self._gpio_mem, offset)[0]
+        value = (value & ~(0b111 << shift)) | (function << shift)
+        GPIO_REG.pack_into(self._gpio_mem, offset, value)
+
+    def setup_realtime(self):
+        """Pin to the isolated CPU and switch to SCHED_FIFO when permitted."""
+        # CPUs we were allowed before pinning (isolcpus keeps RT_CPU out of this set)
+        self._default_cpus = os.sched_getaffinity(0)
+
+        if RT_CPU < (os.cpu_count() or 1):
+            try:
+                os.sched_setaffinity(0, {RT_CPU})
+                print(f"Pinned to CPU {RT_CPU}")
+            except (AttributeError, OSError) as e:
+                print(f"Could not pin to CPU {RT_CPU}: {e}")
+
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(RT_PRIORITY))
+            print(f"Using SCHED_FIFO priority {RT_PRIORITY}")
+        except (AttributeError, OSError) as e:
+            print(f"Could not enable SCHED_FIFO (run as root for real-time priority): {e}")
+
+    def setup_hot_path(self):
+        """Use the compiled hot path when it is built and can drive the registers."""
+        if Hot is not None and self._gpio_mem is not None and not self._verbose:
+            self._hot = Hot(self.note_to_relay, self._note_held, self._relay_refcount,
+                            self._relay_masks, self._gpio_mem, self._off_deadline,
+                            self._deferred, DEBOUNCE_S)
+            print("Using compiled MIDI hot path")
+
+    def setup_midi(self):
+        """Open MIDI input and install the callback (backend-specific)."""
+        raise NotImplementedError
+
+    def connect_midi_port(self):
+        """List MIDI input ports and open the Casio one, or the first available."""
+        available_ports = self.midi_input.get_ports()
+        print("Available MIDI ports:")
+        for i, port in enumerate(available_ports):
+            print(f"  {i}: {port}")
+
+        if not available_ports:
+            raise Exception("No MIDI input ports found!")
+
+        # Find Casio port or use first available
+        casio_port = None
+        for i, port in enumerate(available_ports):
+            if 'casio' in port.lower() or 'ctk' in port.lower():
+                casio_port = i
+                break
+
+        if casio_port is not None:
+            self.midi_input.open_port(casio_port)
+            print(f"Connected to MIDI port: {available_ports[casio_port]}")
+        else:
+            # Use first available port
+            self.midi_input.open_port(0)
+            print(f"Connected to MIDI port: {available_ports[0]}")
+
+    def set_relay(self, relay_channel: int, state: bool):
+        """Control a specific relay channel."""
+        # Most relay boards are active-low (LOW = ON, HIGH = OFF)
+        self._relay_write(*(self._on_args if state else self._off_args)[relay_channel])
+
+    def all_relays_off(self):
+        """Turn every relay off, in a single register write when memory-mapped."""
+        write = self._relay_write
+        for args in self._all_off_args:
+            write(*args)
+
+    def relay_on(self, relay_channel: int):
+        """Turn a relay on, absorbing its deferred OFF if that has not fired yet."""
+        # The service loop clears a deadline only after writing the OFF, so a zero
+        # read here means there is nothing left that could land after our ON
+        if self._off_deadline[relay_channel]:
+            with self._deferred:
+                if self._off_deadline[relay_channel]:
+                    self._off_deadline[relay_channel] = 0.0
+                    return  # Relay never went off
+        self.set_relay(relay_channel, True)
+
+    def relay_off(self, relay_channel: int):
+        """Schedule a relay OFF for the main thread once the debounce window passes."""
+        with self._deferred:
+            self._off_deadline[relay_channel] = time.monotonic() + DEBOUNCE_S
+            self._deferred.notify()
+
+    def service_deferred_offs(self):
+        """Apply deferred relay OFFs as they come due, until stopped."""
+        deadlines = self._off_deadline
+        with self._deferred:
+            while self.running:
+                now = time.monotonic()
+                next_deadline = 0.0
+                for relay_channel, deadline in enumerate(deadlines):
+                    if not deadline:
+                        continue
+                    if deadline <= now:
+                        self.set_relay(relay_channel, False)
+                        deadlines[relay_channel] = 0.0
+                    elif not next_deadline or deadline < next_deadline:
+                        next_deadline = deadline
+                self._deferred.wait(next_deadline - now if next_deadline else None)
+
+    def handle_note_on(self, note: int, velocity: int):
+        """Handle MIDI note on event."""
+        relay_channel = self.note_to_relay[note]
+        if relay_channel != UNMAPPED and velocity:
+            # A repeated Note On for a sounding note must not count the key twice
+            if not self._note_held[note]:
+                self._note_held[note] = 1
+                count = self._relay_refcount[relay_channel]
+                self._relay_refcount[relay_channel] = count + 1
+                if count == 0:
+                    self.relay_on(relay_channel)
+            if self._verbose:
+                self._log_q.append(f"Note ON: {note} (velocity: {velocity}) -> Relay {relay_channel + 1}")
+
+    def handle_note_off(self, note: int):
+        """Handle MIDI note off event."""
+        relay_channel = self.note_to_relay[note]
+        # Ignores keys already down before we started listening, and duplicate Note Offs
+        if relay_channel != UNMAPPED and self._note_held[note]:
+            self._note_held[note] = 0
+            count = self._relay_refcount[relay_channel]
+            self._relay_refcount[relay_channel] = count - 1
+            if count == 1:
+                self.relay_off(relay_channel)
+            if self._verbose:
+                self._log_q.append(f"Note OFF: {note} -> Relay {relay_channel + 1}")
+
+    def run(self):
+        """Main event loop."""
+        self.running = True
+        print("Piano Lights Controller started. Press Ctrl+C to stop.")
+        mapped_notes = [n for n, r in enumerate(self.note_to_relay) if r != UNMAPPED]
+        print(f"Mapped notes: {mapped_notes}")
+
+        if self._verbose:
+            threading.Thread(target=self.drain_log, daemon=True).start()
+
+        # Keep collector pauses out of the MIDI callback while running
+        gc.disable()
+
+        try:
+            # MIDI events arrive on the backend's callback thread; this thread only
+            # sleeps until a deferred relay OFF is due or we are stopped
+            self.service_deferred_offs()
+
+        except KeyboardInterrupt:
+            print("\nShutting down...")
+
+        finally:
+            self.cleanup()
+            gc.enable()
+
+    def drain_log(self):
+        """Write queued note log lines to stdout, off the MIDI callback thread."""
+        # Don't inherit the MIDI thread's SCHED_FIFO priority or its isolated CPU
+        try:
+            os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+            os.sched_setaffinity(0, self._default_cpus)
+        except (AttributeError, OSError):
+            pass
+
+        while self.running:
+            try:
+                sys.stdout.write(self._log_q.popleft() + '\n')
+            except IndexError:
+                time.sleep(0.05)
+
+    def stop(self):
+        """Ask the main event loop to exit."""
+        with self._deferred:
+            self.running = False
+            self._deferred.notify_all()
+
+    def release_gpio(self):
+        """Return the relay pins to inputs and release whichever GPIO backend is open."""
+        if self._hot is not None:
+            self._hot.release()
+        if self._gpio_mem is not None:
+            for pin in self.relay_pins:
+                self.set_pin_function(pin, FSEL_INPUT)
+            self._gpio_mem.close()
+            self._gpio_mem = None
+        elif self._val_fds is not None:
+            self.close_sysfs_values()
+        else:
+            GPIO.cleanup()
+
+    def cleanup(self):
+        """Clean up resources."""
+        self.stop()
+
+        # Close MIDI first so its callback thread has finished before GPIO goes away
+        if self.midi_input:
+            self.midi_input.close_port()
+            self.midi_input = None
+
+        # Turn off all relays, including any still waiting on a deferred OFF
+        for relay_channel in range(len(self._off_deadline)):
+            self._off_deadline[relay_channel] = 0.0
+        self.all_relays_off()
+
+        self.release_gpio()
+
+        print("Cleanup complete.")
@@ -1,180 +1,92 @@
 #!/usr/bin/env python3
 """
-Christmas Piano Lights Controller (RTMidi version)
+Christmas Piano Lights Controller
 Controls 8-channel relay board via Raspberry Pi GPIO pins based on MIDI input from piano.
+MIDI is read from the ALSA sequencer directly, or through RTMidi.
 """
 
-import time
-from typing import Set
+import argparse
 import rtmidi
-import RPi.GPIO as GPIO
+from alsa_seq import AlsaSeqInput, sequencer_available
+from controller_core import NOTE_ON, STATUS_KIND, PianoLightsController
 
-class PianoLightsController:
-    def __init__(self):
-        # GPIO pins for 7-channel relay board (only using first 7)
-        self.relay_pins = [18, 19, 20, 21, 22, 23, 24]
+# Expected message length per status byte (0 = data byte or variable-length SysEx)
+MSG_LEN = bytes([0] * 0x80 +          # Data bytes
+                [3] * 0x40 +          # Note Off/On, Poly Aftertouch, Control Change
+                [2] * 0x20 +          # Program Change, Channel Aftertouch
+                [3] * 0x10 +          # Pitch Bend
+                [0, 2, 3, 2, 1, 1, 1, 1] +  # SysEx, MTC, Song Position/Select, Tune Request
+                [1] * 8)              # System Real-Time (clock, start/stop, sensing)
 
-        # Setup note-to-relay mapping
-        self.setup_note_mapping()
 
-        # Track which notes are currently pressed
-        self.active_notes: Set[int] = set()
+class RtMidiPianoLights(PianoLightsController):
+    """Controller fed by RTMidi's callback thread."""
 
-        # MIDI setup
-        self.midi_input = None
-        self.running = False
-
-        self.setup_gpio()
-        self.setup_midi()
-
-    def setup_note_mapping(self):
-        """Setup mapping from MIDI notes to relay channels."""
-        self.note_to_relay = {}
-
-        # 7-relay mapping focusing on most-used keys (43-70)
-        # Relays 0 and 6 handle leftover low/high keys plus their main range
-        octave_ranges = [
-            (21, 46, 0),   # A0-A#2 (bass leftovers + main) -> Relay 0 (26 keys)
-            (47, 50, 1),   # B2-D3 -> Relay 1 (4 keys)
-            (51, 54, 2),   # D#3-F#3 -> Relay 2 (4 keys)
-            (55, 58, 3),   # G3-A#3 -> Relay 3 (4 keys)
-            (59, 62, 4),   # B3-D4 (Middle C region) -> Relay 4 (4 keys)
-            (63, 66, 5),   # D#4-F#4 -> Relay 5 (4 keys)
-            (67, 108, 6),  # G4-C8 (main + treble leftovers) -> Relay 6 (42 keys)
-        ]
+    def setup_midi(self):
+        """Initialize MIDI input using RTMidi."""
+        self.midi_input = rtmidi.MidiIn()
+        self.connect_midi_port()
+        self.midi_input.set_callback(self._hot.on_message if self._hot else self.midi_callback)
 
-        for start_note, end_note, relay_channel in octave_ranges:
-            for note in range(start_note, end_note + 1):
-                self.note_to_relay[note] = relay_channel
+    def midi_callback(self, event, data=None):
+        """Handle incoming MIDI messages."""
+        message = event[0]
 
-        print(f"Octave mapping loaded: {len(self.note_to_relay)} keys mapped to 7 relays")
+        if MSG_LEN[message[0]] == 3:
+            status, note, velocity = message
 
-    def setup_gpio(self):
-        """Initialize GPIO pins for relay control."""
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
+            # Note On (0x90-0x9F) or Note Off (0x80-0x8F)
+            kind = STATUS_KIND[status]
+            if kind == NOTE_ON and velocity:
+                self.handle_note_on(note, velocity)
+            elif kind:  # Note Off, or Note On with velocity 0
+                self.handle_note_off(note)
 
-        # Setup relay pins as outputs, initially HIGH (relays off for active-low boards)
-        for pin in self.relay_pins:
-            GPIO.setup(pin, GPIO.OUT)
-            GPIO.output(pin, GPIO.HIGH)  # Most relay boards are active-low
 
-        print(f"GPIO initialized for pins: {self.relay_pins}")
+class AlsaSeqPianoLights(PianoLightsController):
+    """Controller fed directly by the ALSA sequencer."""
 
     def setup_midi(self):
-        """Initialize MIDI input using RTMidi."""
-        self.midi_input = rtmidi.MidiIn()
+        """Initialize MIDI input from the ALSA sequencer."""
+        self.midi_input = AlsaSeqInput()
+        self.connect_midi_port()
+        self.midi_input.set_callback(self._hot.on_event if self._hot else self.seq_callback)
 
-        # List available MIDI ports
-        available_ports = self.midi_input.get_ports()
-        print("Available MIDI ports:")
-        for i, port in enumerate(available_ports):
-            print(f"  {i}: {port}")
-
-        if not available_ports:
-            raise Exception("No MIDI input ports found!")
-
-        # Find Casio port or use first available
-        casio_port = None
-        for i, port in enumerate(available_ports):
-            if 'casio' in port.lower() or 'ctk' in port.lower():
-                casio_port = i
-                break
-
-        if casio_port is not None:
-            self.midi_input.open_port(casio_port)
-            print(f"Connected to MIDI port: {available_ports[casio_port]}")
-        else:
-            # Use first available port
-            self.midi_input.open_port(0)
-            print(f"Connected to MIDI port: {available_ports[0]}")
-
-        # Set callback for MIDI messages
-        self.midi_input.set_callback(self.midi_callback)
+    def seq_callback(self, status: int, note: int, velocity: int):
+        """Handle a note event already decoded by the ALSA sequencer."""
+        kind = STATUS_KIND[status]
+        if kind == NOTE_ON and velocity:
+            self.handle_note_on(note, velocity)
+        elif kind:  # Note Off, or Note On with velocity 0
+            self.handle_note_off(note)
 
-    def midi_callback(self, event, data=None):
-        """Handle incoming MIDI messages."""
-        message, deltatime = event
 
-        if len(message) >= 3:
-            status = message[0]
-            note = message[1]
-            velocity = message[2]
+BACKENDS = {
+    'alsa': AlsaSeqPianoLights,
+    'rtmidi': RtMidiPianoLights,
+}
 
-            # Note On (0x90-0x9F) or Note Off (0x80-0x8F)
-            if 0x80 <= status <= 0x8F:  # Note Off
-                self.handle_note_off(note)
-            elif 0x90 <= status <= 0x9F:  # Note On
-                if velocity == 0:  # Note On with velocity 0 = Note Off
-                    self.handle_note_off(note)
-                else:
-                    self.handle_note_on(note, velocity)
-
-    def set_relay(self, relay_channel: int, state: bool):
-        """Control a specific relay channel."""
-        if 0 <= relay_channel < len(self.relay_pins):
-            pin = self.relay_pins[relay_channel]
-            # Most relay boards are active-low (LOW = ON, HIGH = OFF)
-            GPIO.output(pin, GPIO.LOW if state else GPIO.HIGH)
-            print(f"Relay {relay_channel + 1} {'ON' if state else 'OFF'}")
-
-    def handle_note_on(self, note: int, velocity: int):
-        """Handle MIDI note on event."""
-        if note in self.note_to_relay and velocity > 0:
-            relay_channel = self.note_to_relay[note]
-            self.active_notes.add(note)
-            self.set_relay(relay_channel, True)
-            print(f"Note ON: {note} (velocity: {velocity}) -> Relay {relay_channel + 1}")
-
-    def handle_note_off(self, note: int):
-        """Handle MIDI note off event."""
-        if note in self.note_to_relay and note in self.active_notes:
-            relay_channel = self.note_to_relay[note]
-            self.active_notes.discard(note)
-            self.set_relay(relay_channel, False)
-            print(f"Note OFF: {note} -> Relay {relay_channel + 1}")
-
-    def run(self):
-        """Main event loop."""
-        self.running = True
-        print("Piano Lights Controller started. Press Ctrl+C to stop.")
-        print(f"Mapped notes: {list(self.note_to_relay.keys())}")
-
-        try:
-            while self.running:
-                time.sleep(0.1)  # Keep the program running
-
-        except KeyboardInterrupt:
-            print("\nShutting down...")
-
-        finally:
-            self.cleanup()
-
-    def cleanup(self):
-        """Clean up resources."""
-        self.running = False
-
-        # Turn off all relays
-        for i in range(len(self.relay_pins)):
-            self.set_relay(i, False)
-
-        # Cleanup GPIO
-        GPIO.cleanup()
-
-        # Close MIDI
-        if self.midi_input:
-            self.midi_input.close_port()
-
-        print("Cleanup complete.")
 
 def main():
     """Main entry point."""
+    parser = argparse.ArgumentParser(description="Christmas Piano Lights Controller")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="log every note on/off event")
+    parser.add_argument('-b', '--backend', choices=['auto', *BACKENDS], default='auto',
+                        help="MIDI input backend (default: ALSA sequencer if available, else RTMidi)")
+    args = parser.parse_args()
+
+    backend = args.backend
+    if backend == 'auto':
+        backend = 'alsa' if sequencer_available() else 'rtmidi'
+    print(f"Using {backend} MIDI backend")
+
     try:
-        controller = PianoLightsController()
+        controller = BACKENDS[backend](verbose=args.verbose)
         controller.run()
     except Exception as e:
+        # The controller releases its own GPIO backend if startup fails
         print(f"Error: {e}")
-        GPIO.cleanup()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
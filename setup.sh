@@ -4,9 +4,12 @@
 echo "Installing Python dependencies..."
 pip3 install -r requirements.txt
 
-echo "Making piano_lights.py executable..."
-chmod +x piano_lights.py
+echo "Building optional compiled MIDI hot path..."
+pip3 install cython && cythonize -i _piano_hot.pyx || echo "Build failed; the pure Python hot path will be used."
 
-echo "Setup complete! Run with: python3 piano_lights.py"
+echo "Making piano_lights_rtmidi.py executable..."
+chmod +x piano_lights_rtmidi.py
+
+echo "Setup complete! Run with: python3 piano_lights_rtmidi.py"
 echo ""
 echo "Note: Make sure your MIDI piano is connected via USB before running."
\ No newline at end of file